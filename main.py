@@ -2,154 +2,339 @@
 # 🚀 main.py — Versión mejorada para GitHub Actions
 # =========================================
 
+import io
 import os
+import requests
 import tweepy
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google.cloud import bigquery
+from google.cloud import bigquery_storage_v1
+from google.cloud.bigquery_storage_v1 import types as bq_types
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+# Copia única de las variables de entorno, leída al iniciar el proceso
+ENV = dict(os.environ)
+
+# Esquema Arrow de la tabla destino (mismo orden y tipos que en BigQuery)
+ARROW_SCHEMA = pa.schema([
+    ("Id", pa.string()),
+    ("Text", pa.string()),
+    ("Autor", pa.string()),
+    ("Retweet", pa.int64()),
+    ("Reply", pa.int64()),
+    ("Likes", pa.int64()),
+    ("Quote", pa.int64()),
+    ("Bookmark", pa.int64()),
+    ("Impression", pa.int64()),
+    ("Created", pa.timestamp("us")),  # DATETIME (sin zona horaria)
+])
+
+# Esquema BigQuery y configuración del load job, construidos una sola vez
+BQ_SCHEMA = [
+    bigquery.SchemaField("Id", "STRING"),
+    bigquery.SchemaField("Text", "STRING"),
+    bigquery.SchemaField("Autor", "STRING"),
+    bigquery.SchemaField("Retweet", "INTEGER"),
+    bigquery.SchemaField("Reply", "INTEGER"),
+    bigquery.SchemaField("Likes", "INTEGER"),
+    bigquery.SchemaField("Quote", "INTEGER"),
+    bigquery.SchemaField("Bookmark", "INTEGER"),
+    bigquery.SchemaField("Impression", "INTEGER"),
+    bigquery.SchemaField("Created", "DATETIME"),
+]
+LOAD_JOB_CONFIG = bigquery.LoadJobConfig(
+    write_disposition="WRITE_APPEND",
+    source_format=bigquery.SourceFormat.PARQUET,
+    schema=BQ_SCHEMA,
+)
+
+# Columnas de métricas -> clave en public_metrics
+METRIC_COLUMNS = (
+    ("Retweet", "retweet_count"),
+    ("Reply", "reply_count"),
+    ("Likes", "like_count"),
+    ("Quote", "quote_count"),
+    ("Bookmark", "bookmark_count"),
+    ("Impression", "impression_count"),
+)
+
+# Zona horaria de Ecuador (UTC-5, sin horario de verano)
+EC_TZ = "America/Guayaquil"
+
+# Consulta y campos de la búsqueda (ya unidos por comas, como los espera la API)
+TWEET_QUERY = ENV.get("X_QUERY", "@BancoPichincha -is:retweet")
+TWEET_FIELDS = "created_at,public_metrics,author_id,text"
+USER_FIELDS = "username"
+EXPANSIONS = "author_id"
+
+
+def _env_positive_int(name, default):
+    """Lee un entero >= 1 desde ENV; si falta o no es válido usa el valor por defecto."""
+    raw = (ENV.get(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 0
+    if value < 1:
+        print(f"⚠️ {name}={raw!r} no es un entero >= 1; se usa el valor por defecto {default}.")
+        return default
+    return value
+
+
+# Máximo de tweets recolectados por ejecución (páginas de 100, el máximo de la API)
+TWEET_MAX = _env_positive_int("TWEET_MAX", 1000)
+
+# Filas por AppendRows y umbral a partir del cual se usa un load job
+APPEND_CHUNK_ROWS = 500
+LOAD_JOB_MIN_ROWS = 50_000
+
+
+# -----------------------------------------
+# 0️⃣ ESQUEMA PROTOBUF PARA STORAGE WRITE API
+# -----------------------------------------
+def _build_row_descriptor():
+    """Compila una sola vez el mensaje protobuf equivalente a una fila de la tabla."""
+    F = descriptor_pb2.FieldDescriptorProto
+    proto = descriptor_pb2.DescriptorProto(name="TweetRow")
+    for number, field in enumerate(ARROW_SCHEMA, start=1):
+        kind = F.TYPE_INT64 if pa.types.is_integer(field.type) else F.TYPE_STRING
+        proto.field.add(name=field.name, number=number, type=kind, label=F.LABEL_OPTIONAL)
+
+    file_proto = descriptor_pb2.FileDescriptorProto(name="tweet_row.proto", syntax="proto2")
+    file_proto.message_type.add().CopyFrom(proto)
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    row_class = message_factory.GetMessageClass(pool.FindMessageTypeByName("TweetRow"))
+    return proto, row_class
+
+
+ROW_DESCRIPTOR, TweetRow = _build_row_descriptor()
+
 
 # -----------------------------------------
 # 1️⃣ AUTENTICACIÓN CON TWITTER
 # -----------------------------------------
-def get_twitter_client():
-    """Obtiene el cliente de la API de XTwitter usando BEARER_TOKEN_1 o BEARER_TOKEN_2."""
-    token1 = (os.getenv("BEARER_TOKEN_1") or "").strip()
-    token2 = (os.getenv("BEARER_TOKEN_2") or "").strip()
+def _build_twitter_session():
+    """Sesión HTTP reutilizable: pool de conexiones keep-alive, reintentos ante 5xx y gzip."""
+    # Los 429 no se reintentan aquí: tweepy espera el reset (wait_on_rate_limit=True)
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry))
+    session.headers.update({"Accept-Encoding": "gzip"})
+    return session
+
+
+def get_twitter_clients():
+    """Genera un cliente de la API de XTwitter por cada BEARER_TOKEN_1/BEARER_TOKEN_2 disponible.
+
+    No se hace ninguna llamada de prueba: la primera búsqueda valida el token.
+    """
+    token1 = (ENV.get("BEARER_TOKEN_1") or "").strip()
+    token2 = (ENV.get("BEARER_TOKEN_2") or "").strip()
 
     for i, token in enumerate([token1, token2], start=1):
         if not token:
             print(f"⚠️ BEARER_TOKEN_{i} no encontrado o vacío.")
             continue
-        try:
-            print(f"🔑 Probando autenticación con BEARER_TOKEN_{i} (len={len(token)})...")
-            client = tweepy.Client(bearer_token=token, wait_on_rate_limit=True)
-
-            # Prueba con un tweet público (ID=20)
-            test = client.get_tweet(id=20)
-            if test.errors:
-                print(f"⚠️ Token {i} no autorizado: {test.errors}")
-                continue
-
-            print(f"✅ Autenticación exitosa con BEARER_TOKEN_{i}")
-            return client
-
-        except Exception as e:
-            print(f"❌ Error con BEARER_TOKEN_{i}: {e}")
-
-    raise RuntimeError("❌ No se pudo autenticar con ninguno de los BEARER_TOKEN disponibles.")
+        print(f"🔑 Usando BEARER_TOKEN_{i} (len={len(token)})...")
+        client = tweepy.Client(bearer_token=token, wait_on_rate_limit=True)
+        client.session = _build_twitter_session()
+        yield i, client
 
 
 # -----------------------------------------
 # 2️⃣ BÚSQUEDA DE TWEETS
 # -----------------------------------------
 def fetch_tweets(client):
-    """Obtiene tweets de las últimas 24 horas que mencionen a @BancoPichincha."""
+    """Obtiene tweets de las últimas 24 horas que coincidan con TWEET_QUERY (por defecto @BancoPichincha).
+
+    Devuelve (tweets, users) donde users mapea author_id -> username a partir
+    de la expansión author_id incluida en cada página.
+    """
     end_time = datetime.now(timezone.utc)
     start_time = end_time - timedelta(hours=24)
-    query = "@BancoPichincha -is:retweet"
 
     print(f"🔎 Buscando tweets desde {start_time.isoformat()} hasta {end_time.isoformat()}...")
 
     tweets = []
+    users = {}
+    pages = 0
     try:
-        for tweet in tweepy.Paginator(
+        # Recorrer página por página (una llamada a la API por página)
+        for response in tweepy.Paginator(
             client.search_recent_tweets,
-            query=query,
-            tweet_fields=["created_at", "public_metrics", "author_id", "text"],
-            user_fields=["username"],
-            expansions=["author_id"],
+            query=TWEET_QUERY,
+            start_time=start_time,
+            tweet_fields=TWEET_FIELDS,
+            user_fields=USER_FIELDS,
+            expansions=EXPANSIONS,
             max_results=100
-        ).flatten(limit=200):
-            tweets.append(tweet)
+        ):
+            pages += 1
+            tweets.extend(response.data or [])
+            for u in response.includes.get("users", []):
+                users[u.id] = u.username
+            if len(tweets) >= TWEET_MAX or not response.meta.get("next_token"):
+                break
+        tweets = tweets[:TWEET_MAX]
 
         print(f"✅ Se obtuvieron {len(tweets)} tweets recientes.")
     except Exception as e:
-        print(f"⚠️ Error al obtener tweets: {e}")
-    return tweets
+        if not pages:
+            raise  # Falló la primera búsqueda: el token o la consulta no sirven
+        # Fallo a mitad de la paginación: se conservan las páginas ya obtenidas
+        print(f"⚠️ Error al obtener tweets; se conservan {len(tweets)} tweets de {pages} página(s): {e}")
+    return tweets, users
+
+
+def fetch_tweets_with_fallback():
+    """Busca tweets con el primer BEARER_TOKEN cuya primera búsqueda tenga éxito.
+
+    Si todos fallan se lanza RuntimeError, para que la ejecución termine con
+    error en lugar de parecer una ventana sin tweets.
+    """
+    for i, client in get_twitter_clients():
+        try:
+            tweets, users = fetch_tweets(client)
+        except (tweepy.Unauthorized, tweepy.Forbidden) as e:
+            print(f"⚠️ Token {i} no autorizado: {e}")
+            continue
+        except Exception as e:
+            print(f"❌ Error con BEARER_TOKEN_{i}: {e}")
+            continue
+
+        print(f"✅ Autenticación exitosa con BEARER_TOKEN_{i}")
+        return tweets, users
+
+    raise RuntimeError("❌ No se pudo buscar tweets con ninguno de los BEARER_TOKEN disponibles.")
 
 
 # -----------------------------------------
-# 3️⃣ CREACIÓN DE DATAFRAME
+# 3️⃣ CREACIÓN DE TABLA ARROW
 # -----------------------------------------
-def build_dataframe(tweets, client):
-    """Transforma los tweets en un DataFrame compatible con BigQuery."""
+def build_table(tweets, users):
+    """Transforma los tweets en una tabla Arrow columnar compatible con BigQuery."""
     if not tweets:
         print("⚠️ Lista de tweets vacía.")
-        return pd.DataFrame()
+        return ARROW_SCHEMA.empty_table()
 
-    data = []
-    users = {}
+    # Dict de columnas: una comprensión por columna, sin dicts intermedios por tweet
+    metrics = [t.public_metrics or {} for t in tweets]
+    columns = {
+        "Id": [str(t.id) for t in tweets],
+        "Text": [t.text for t in tweets],
+        "Autor": [users.get(t.author_id, "desconocido") for t in tweets],
+    }
+    for column, key in METRIC_COLUMNS:
+        columns[column] = [m.get(key, 0) for m in metrics]
 
-    # Obtener los usuarios en bloque
-    author_ids = list({t.author_id for t in tweets if t.author_id})
-    user_data = client.get_users(ids=author_ids, user_fields=["username"]).data or []
-    for u in user_data:
-        users[u.id] = u.username
-
-    for t in tweets:
-        metrics = t.public_metrics or {}
-        data.append({
-            "Id": str(t.id),
-            "Text": t.text,
-            "Autor": users.get(t.author_id, "desconocido"),
-            "Retweet": metrics.get("retweet_count", 0),
-            "Reply": metrics.get("reply_count", 0),
-            "Likes": metrics.get("like_count", 0),
-            "Quote": metrics.get("quote_count", 0),
-            "Bookmark": metrics.get("bookmark_count", 0),
-            "Impression": metrics.get("impression_count", 0),
-            "Created": t.created_at.astimezone(timezone(timedelta(hours=-5)))  # hora Ecuador
-        })
-
-    df = pd.DataFrame(data)
-    print(f"📊 DataFrame creado con {len(df)} registros.")
-    return df
+    # Conversión vectorizada UTC -> hora local de Ecuador (sin zona horaria)
+    created_utc = pa.array([t.created_at for t in tweets], type=pa.timestamp("us", tz="UTC"))
+    columns["Created"] = pc.local_timestamp(created_utc.cast(pa.timestamp("us", tz=EC_TZ)))
+
+    table = pa.table(columns, schema=ARROW_SCHEMA)
+    print(f"📊 Tabla Arrow creada con {table.num_rows} registros.")
+    return table
 
 
 # -----------------------------------------
 # 4️⃣ CARGA EN BIGQUERY
 # -----------------------------------------
-def load_to_bigquery(df, table_fqn):
-    """Carga los tweets en la tabla BigQuery."""
-    if df.empty:
-        print("⚠️ DataFrame vacío. No se insertarán datos en BigQuery.")
-        return
+def _serialized_rows(table):
+    """Serializa la tabla Arrow a filas protobuf recorriéndola por columnas."""
+    columns = {}
+    for name in table.column_names:
+        values = table.column(name).to_pylist()
+        if name == "Created":
+            # Storage Write API acepta DATETIME como texto civil "YYYY-MM-DD HH:MM:SS.ffffff"
+            values = [v.isoformat(sep=" ") if v is not None else None for v in values]
+        columns[name] = values
 
-    client = bigquery.Client()
-
-    job_config = bigquery.LoadJobConfig(
-        write_disposition="WRITE_APPEND",
-        schema=[
-            bigquery.SchemaField("Id", "STRING"),
-            bigquery.SchemaField("Text", "STRING"),
-            bigquery.SchemaField("Autor", "STRING"),
-            bigquery.SchemaField("Retweet", "INTEGER"),
-            bigquery.SchemaField("Reply", "INTEGER"),
-            bigquery.SchemaField("Likes", "INTEGER"),
-            bigquery.SchemaField("Quote", "INTEGER"),
-            bigquery.SchemaField("Bookmark", "INTEGER"),
-            bigquery.SchemaField("Impression", "INTEGER"),
-            bigquery.SchemaField("Created", "DATETIME"),
-        ],
-    )
+    rows = []
+    for i in range(table.num_rows):
+        row = TweetRow()
+        for name, values in columns.items():
+            if values[i] is not None:
+                setattr(row, name, values[i])
+        rows.append(row.SerializeToString())
+    return rows
 
-    print(f"🚀 Cargando datos en BigQuery: {table_fqn} ...")
-    job = client.load_table_from_dataframe(df, table_fqn, job_config=job_config)
+
+def _append_requests(rows, stream_name):
+    """Genera un AppendRowsRequest por cada bloque de APPEND_CHUNK_ROWS filas."""
+    for start in range(0, len(rows), APPEND_CHUNK_ROWS):
+        proto_data = bq_types.AppendRowsRequest.ProtoData(
+            writer_schema=bq_types.ProtoSchema(proto_descriptor=ROW_DESCRIPTOR),
+            rows=bq_types.ProtoRows(serialized_rows=rows[start:start + APPEND_CHUNK_ROWS]),
+        )
+        yield bq_types.AppendRowsRequest(write_stream=stream_name, proto_rows=proto_data)
+
+
+def _load_with_job(table, table_fqn, client):
+    """Carga masiva mediante load job Parquet (para lotes muy grandes)."""
+    # Serializar la tabla Arrow a Parquet en memoria
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    buffer.seek(0)
+
+    job = client.load_table_from_file(buffer, table_fqn, job_config=LOAD_JOB_CONFIG)
     job.result()  # Esperar a que finalice
-    print(f"✅ {len(df)} registros insertados en {table_fqn} exitosamente.")
+
+
+def _load_with_storage_write(table, table_fqn, write_client):
+    """Inserta las filas en el stream _default de la Storage Write API."""
+    # from_string acepta también proyectos con dominio (example.com:proyecto.dataset.tabla)
+    ref = bigquery.TableReference.from_string(table_fqn)
+    stream_name = f"{write_client.table_path(ref.project, ref.dataset_id, ref.table_id)}/streams/_default"
+    # Cabecera de enrutamiento requerida para que la API sepa a qué región enviar el stream
+    metadata = (("x-goog-request-params", f"write_stream={stream_name}"),)
+
+    rows = _serialized_rows(table)
+    # Todas las peticiones viajan por un único stream bidireccional (pipeline)
+    requests_iter = _append_requests(rows, stream_name)
+    for response in write_client.append_rows(requests_iter, metadata=metadata):
+        if response.error.code or response.row_errors:
+            raise RuntimeError(f"❌ Error en AppendRows: {response.error.message or response.row_errors}")
+
+
+def load_to_bigquery(table, table_fqn, bq_client, write_client):
+    """Carga los tweets en la tabla BigQuery (Storage Write API o load job Parquet).
+
+    Los clientes se crean una sola vez en el flujo principal y se reutilizan.
+    """
+    if table.num_rows == 0:
+        print("⚠️ Tabla vacía. No se insertarán datos en BigQuery.")
+        return
+
+    print(f"🚀 Cargando datos en BigQuery: {table_fqn} ...")
+    if table.num_rows > LOAD_JOB_MIN_ROWS:
+        _load_with_job(table, table_fqn, bq_client)
+    else:
+        _load_with_storage_write(table, table_fqn, write_client)
+    print(f"✅ {table.num_rows} registros insertados en {table_fqn} exitosamente.")
 
 
 # -----------------------------------------
 # 5️⃣ FLUJO PRINCIPAL
 # -----------------------------------------
 if __name__ == "__main__":
-    TABLE_FQN = os.getenv("BQ_TABLE_FQN", "xpry-472917.xds.xtable")
+    TABLE_FQN = ENV.get("BQ_TABLE_FQN", "xpry-472917.xds.xtable")
 
-    twitter_client = get_twitter_client()
-    tweets = fetch_tweets(twitter_client)
+    tweets, users = fetch_tweets_with_fallback()
 
     if tweets:
-        df = build_dataframe(tweets, twitter_client)
-        load_to_bigquery(df, TABLE_FQN)
+        table = build_table(tweets, users)
+
+        # Clientes de BigQuery creados una sola vez por ejecución
+        bq_client = bigquery.Client()
+        write_client = bigquery_storage_v1.BigQueryWriteClient()
+        load_to_bigquery(table, TABLE_FQN, bq_client, write_client)
     else:
         print("⚠️ No se encontraron tweets en las últimas 24 horas.")